@@ -5,6 +5,7 @@ from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from flask_cors import CORS
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.schema import CreateIndex
 from werkzeug.middleware.proxy_fix import ProxyFix
 
 # Configure logging
@@ -40,3 +41,23 @@ with app.app_context():
     
     # Create all tables
     db.create_all()
+
+@app.cli.command('create-indexes')
+def create_indexes():
+    """Add model indexes missing from tables that already existed."""
+    # create_all only builds indexes for the tables it creates. Run this once
+    # after deploying new indexes rather than in every worker at boot.
+    postgresql = db.engine.dialect.name == 'postgresql'
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction block
+    with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+        for table in db.metadata.sorted_tables:
+            for index in table.indexes:
+                if postgresql:
+                    # Build without blocking writes to the table
+                    index.dialect_kwargs['postgresql_concurrently'] = True
+                try:
+                    conn.execute(CreateIndex(index, if_not_exists=True))
+                finally:
+                    if postgresql:
+                        index.dialect_kwargs['postgresql_concurrently'] = False
+                logging.info(f"Index {index.name} is in place")
@@ -0,0 +1,244 @@
+import os
+import logging
+from datetime import datetime
+
+import click
+from sqlalchemy import MetaData, select, insert, delete, func, case, text
+from sqlalchemy.schema import CreateTable, CreateIndex
+
+from app import db
+from models import Transaction, MpesaPayment, TransactionArchive, MpesaPaymentArchive, BalanceSnapshot
+
+def month_start(value):
+    """First instant of the month containing value"""
+    return datetime(value.year, value.month, 1)
+
+def add_months(value, months):
+    """Shift a month start by a number of months"""
+    index = value.year * 12 + value.month - 1 + months
+    return datetime(index // 12, index % 12 + 1, 1)
+
+class HistoryArchive:
+    """Moves closed monthly periods out of the live tables and snapshots their balances"""
+
+    # Live tables and the archive tables their closed rows move to
+    ARCHIVED = ((MpesaPayment, MpesaPaymentArchive), (Transaction, TransactionArchive))
+
+    def __init__(self):
+        self.keep_months = int(os.getenv('ARCHIVE_KEEP_MONTHS', '3'))
+
+    def init_app(self, app):
+        """Register the compaction command on the Flask CLI"""
+        @app.cli.command('compact-history')
+        @click.option('--before', type=click.DateTime(formats=['%Y-%m']),
+                      help='Close every month before this one (YYYY-MM).')
+        @click.option('--keep-months', type=click.IntRange(min=1),
+                      help='Months to keep live, including the current one.')
+        def compact_history(before, keep_months):
+            """Archive closed months and record their balance snapshots."""
+            cutoff = before or self.default_cutoff(keep_months)
+            if month_start(cutoff) > month_start(datetime.utcnow()):
+                raise click.BadParameter('Cannot close the current or a future month', param_hint="'--before'")
+            try:
+                snapshots = self.compact(cutoff)
+            except RuntimeError as e:
+                raise click.ClickException(str(e))
+            click.echo(f"Closed {len(snapshots)} period(s) before {cutoff:%Y-%m}")
+
+        @app.cli.command('upgrade-archive-ids')
+        def upgrade_archive_ids():
+            """Rebuild SQLite live tables created without AUTOINCREMENT."""
+            for model, archive_model in self.ARCHIVED:
+                if self.reuses_ids(model):
+                    self._rebuild_with_autoincrement(model, archive_model)
+                    click.echo(f"Rebuilt {model.__tablename__} with AUTOINCREMENT")
+            click.echo("Run 'flask init-search' to rebuild the search index if search is enabled")
+
+    def default_cutoff(self, keep_months=None):
+        keep = self.keep_months if keep_months is None else keep_months
+        return add_months(month_start(datetime.utcnow()), -max(keep - 1, 0))
+
+    def latest_snapshot(self):
+        return BalanceSnapshot.query.order_by(BalanceSnapshot.period_end.desc()).first()
+
+    def balance_totals(self):
+        """Income and expense totals of closed periods plus live transactions.
+
+        The latest snapshot and the live sums are read in one statement, so a
+        compaction committing in between cannot count a month twice or drop it.
+        """
+        total_income, total_expenses = db.session.execute(self.balance_query()).one()
+        return total_income, total_expenses
+
+    def balance_query(self):
+        return select(
+            func.coalesce(self._carried(BalanceSnapshot.total_income), 0)
+            + func.coalesce(self._live_sum('income'), 0),
+            func.coalesce(self._carried(BalanceSnapshot.total_expenses), 0)
+            + func.coalesce(self._live_sum('expense'), 0)
+        )
+
+    def _carried(self, column):
+        return select(column).order_by(BalanceSnapshot.period_end.desc()).limit(1).scalar_subquery()
+
+    def _live_sum(self, transaction_type):
+        return select(func.sum(Transaction.amount)).where(
+            Transaction.transaction_type == transaction_type
+        ).scalar_subquery()
+
+    def compact(self, cutoff):
+        """Close every month before cutoff: snapshot it, then move its rows to the archive tables"""
+        cutoff = month_start(cutoff)
+        if cutoff > month_start(datetime.utcnow()):
+            raise ValueError('Cannot close the current or a future month')
+
+        stale = [model.__tablename__ for model, _ in self.ARCHIVED if self.reuses_ids(model)]
+        if stale:
+            raise RuntimeError(
+                f"{', '.join(stale)} can reuse archived ids; run 'flask upgrade-archive-ids' first"
+            )
+
+        try:
+            snapshots = self._snapshot_periods(cutoff)
+            if snapshots:
+                self._move_rows(snapshots[-1].period_end)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+        for snapshot in snapshots:
+            logging.info(f"Closed period {snapshot.period_start:%Y-%m}: {snapshot.transaction_count} transactions")
+        return snapshots
+
+    def _snapshot_periods(self, cutoff):
+        latest = self.latest_snapshot()
+        if latest:
+            period_start = latest.period_end
+            total_income, total_expenses = latest.total_income, latest.total_expenses
+        else:
+            oldest = db.session.query(func.min(Transaction.created_at)).scalar()
+            if oldest is None:
+                return []
+            period_start = month_start(oldest)
+            total_income = total_expenses = 0
+
+        snapshots = []
+        while period_start < cutoff:
+            period_end = add_months(period_start, 1)
+            period_income, period_expenses, count = db.session.query(
+                func.sum(case((Transaction.transaction_type == 'income', Transaction.amount), else_=0)),
+                func.sum(case((Transaction.transaction_type == 'expense', Transaction.amount), else_=0)),
+                func.count(Transaction.id)
+            ).filter(
+                Transaction.created_at >= period_start,
+                Transaction.created_at < period_end
+            ).one()
+
+            total_income += period_income or 0
+            total_expenses += period_expenses or 0
+            snapshot = BalanceSnapshot(
+                period_start=period_start,
+                period_end=period_end,
+                period_income=period_income or 0,
+                period_expenses=period_expenses or 0,
+                total_income=total_income,
+                total_expenses=total_expenses,
+                transaction_count=count
+            )
+            db.session.add(snapshot)
+            snapshots.append(snapshot)
+            period_start = period_end
+        return snapshots
+
+    def _move_rows(self, cutoff):
+        # Pending payments stay live so their callbacks can still settle them.
+        # Settled payments are always created before their transaction, so every
+        # live payment that references an archived transaction is archived with it.
+        settled = (MpesaPayment.created_at < cutoff) & (MpesaPayment.status != 'pending')
+        self._move(MpesaPayment, MpesaPaymentArchive, settled)
+        self._move(Transaction, TransactionArchive, Transaction.created_at < cutoff)
+
+    def reuses_ids(self, model):
+        """Whether SQLite may give a new live row the id of an archived one.
+
+        Without AUTOINCREMENT SQLite picks max(id) + 1, so once the newest rows
+        are archived their ids come back and collide in the archive table.
+        """
+        if db.engine.dialect.name != 'sqlite':
+            return False
+        sql = db.session.execute(text(
+            "SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"
+        ), {'name': model.__tablename__}).scalar()
+        return 'AUTOINCREMENT' not in (sql or '').upper()
+
+    def _rebuild_with_autoincrement(self, model, archive_model):
+        # SQLite cannot add AUTOINCREMENT to an existing table, so copy the rows
+        # into a new one and swap it in. The search view, triggers and index go
+        # with the old table; init-search rebuilds them.
+        name = model.__tablename__
+        archive = archive_model.__tablename__
+        metadata = MetaData()
+        for table in db.metadata.sorted_tables:
+            if table is not model.__table__:
+                table.to_metadata(metadata)
+        staging = model.__table__.to_metadata(metadata, name=f'{name}__rebuild')
+        columns = ', '.join(f'"{column.name}"' for column in model.__table__.columns)
+        references = [
+            (foreign_key.parent.table.name, foreign_key.parent.name)
+            for table in db.metadata.sorted_tables
+            for foreign_key in table.foreign_keys
+            if foreign_key.column.table is model.__table__
+        ]
+        highest = (
+            f'max((SELECT coalesce(max(id), 0) FROM "{name}"), '
+            f'(SELECT coalesce(max(id), 0) FROM "{archive}"))'
+        )
+        reused = f'SELECT live.id FROM "{name}" AS live JOIN "{archive}" USING (id)'
+
+        db.session.remove()
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            foreign_keys = conn.exec_driver_sql('PRAGMA foreign_keys').scalar()
+            conn.exec_driver_sql('PRAGMA foreign_keys = OFF')
+            conn.exec_driver_sql('BEGIN')
+            try:
+                conn.exec_driver_sql(f'DROP VIEW IF EXISTS "{name}_search_source"')
+                conn.exec_driver_sql(f'DROP TABLE IF EXISTS "{name}_search_index"')
+                conn.execute(CreateTable(staging))
+                conn.exec_driver_sql(f'INSERT INTO "{name}__rebuild" ({columns}) SELECT {columns} FROM "{name}"')
+                conn.exec_driver_sql(f'DROP TABLE "{name}"')
+                conn.exec_driver_sql(f'ALTER TABLE "{name}__rebuild" RENAME TO "{name}"')
+                for index in model.__table__.indexes:
+                    conn.execute(CreateIndex(index))
+
+                # Live rows that already took an archived id move above every id in
+                # use, along with the live rows that reference them
+                offset = conn.exec_driver_sql(f'SELECT {highest}').scalar()
+                for table_name, column_name in references:
+                    conn.exec_driver_sql(
+                        f'UPDATE "{table_name}" SET "{column_name}" = "{column_name}" + {offset} '
+                        f'WHERE "{column_name}" IN ({reused})'
+                    )
+                conn.exec_driver_sql(f'UPDATE "{name}" SET id = id + {offset} WHERE id IN ({reused})')
+
+                # Never hand out an id that is already in the archive
+                conn.execute(text("DELETE FROM sqlite_sequence WHERE name = :name"), {'name': name})
+                conn.execute(text(f"INSERT INTO sqlite_sequence (name, seq) SELECT :name, {highest}"), {'name': name})
+                conn.exec_driver_sql('COMMIT')
+            except Exception:
+                conn.exec_driver_sql('ROLLBACK')
+                raise
+            finally:
+                conn.exec_driver_sql(f'PRAGMA foreign_keys = {foreign_keys}')
+
+    def _move(self, model, archive_model, condition):
+        columns = [column.name for column in model.__table__.columns]
+        db.session.execute(
+            insert(archive_model.__table__).from_select(
+                columns, select(*[model.__table__.c[name] for name in columns]).where(condition)
+            )
+        )
+        db.session.execute(delete(model.__table__).where(condition))
+
+# Global archive instance
+history_archive = HistoryArchive()
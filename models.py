@@ -38,6 +38,17 @@ class Transaction(db.Model):
     payment_method = db.Column(db.String(20), default='manual', nullable=False)  # 'manual', 'mpesa'
     mpesa_receipt_number = db.Column(db.String(50), nullable=True)  # M-Pesa receipt
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        # Balance sums filter by type; including amount lets them run off the index alone
+        db.Index('ix_transaction_type_amount', 'transaction_type', 'amount'),
+        # Listing is ordered newest first
+        db.Index('ix_transaction_created_at', 'created_at'),
+        # Receipt lookups for M-Pesa reconciliation
+        db.Index('ix_transaction_mpesa_receipt_number', 'mpesa_receipt_number'),
+        # Archived rows keep their id, so SQLite must never hand it out again
+        {'sqlite_autoincrement': True},
+    )
     
     def to_dict(self):
         """Convert transaction to dictionary for JSON serialization"""
@@ -68,6 +79,17 @@ class MpesaPayment(db.Model):
     transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id'), nullable=True)
     created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, nullable=False)
+
+    __table_args__ = (
+        # Reconciliation scans pending/failed payments by age; PostgreSQL also
+        # carries the checkout id so that scan can be an index-only scan
+        db.Index('ix_mpesa_payment_status_created_at', 'status', 'created_at',
+                 postgresql_include=['checkout_request_id']),
+        # Payment history is ordered newest first
+        db.Index('ix_mpesa_payment_created_at', 'created_at'),
+        # Archived rows keep their id, so SQLite must never hand it out again
+        {'sqlite_autoincrement': True},
+    )
     
     # Relationship
     transaction = db.relationship('Transaction', backref='mpesa_payment', uselist=False)
@@ -91,3 +113,77 @@ class MpesaPayment(db.Model):
     
     def __repr__(self):
         return f'<MpesaPayment {self.checkout_request_id}: {self.amount}>'
+
+class TransactionArchive(db.Model):
+    """Transactions from closed periods, moved out of the live table by compaction"""
+    __tablename__ = 'transaction_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    description = db.Column(db.String(200), nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+    transaction_type = db.Column(db.String(10), nullable=False)
+    payment_method = db.Column(db.String(20), default='manual', nullable=False)
+    mpesa_receipt_number = db.Column(db.String(50), nullable=True)
+    created_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_transaction_archive_created_at', 'created_at'),
+        db.Index('ix_transaction_archive_mpesa_receipt_number', 'mpesa_receipt_number'),
+    )
+
+    to_dict = Transaction.to_dict
+
+    def __repr__(self):
+        return f'<TransactionArchive {self.description}: {self.amount}>'
+
+class MpesaPaymentArchive(db.Model):
+    """Settled M-Pesa payments from closed periods"""
+    __tablename__ = 'mpesa_payment_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    checkout_request_id = db.Column(db.String(100), unique=True, nullable=False)
+    phone_number = db.Column(db.String(15), nullable=False)
+    amount = db.Column(db.Float, nullable=False)
+    account_reference = db.Column(db.String(50), nullable=False)
+    transaction_desc = db.Column(db.String(200), nullable=False)
+    status = db.Column(db.String(20), nullable=False)
+    mpesa_receipt_number = db.Column(db.String(50), nullable=True)
+    result_desc = db.Column(db.String(200), nullable=True)
+    transaction_id = db.Column(db.Integer, nullable=True)  # id in transaction_archive
+    created_at = db.Column(db.DateTime, nullable=False)
+    updated_at = db.Column(db.DateTime, nullable=False)
+
+    __table_args__ = (
+        db.Index('ix_mpesa_payment_archive_created_at', 'created_at'),
+    )
+
+    to_dict = MpesaPayment.to_dict
+
+    def __repr__(self):
+        return f'<MpesaPaymentArchive {self.checkout_request_id}: {self.amount}>'
+
+class BalanceSnapshot(db.Model):
+    """Totals for a closed monthly period, carried forward from all earlier periods"""
+    id = db.Column(db.Integer, primary_key=True)
+    period_start = db.Column(db.DateTime, nullable=False)
+    period_end = db.Column(db.DateTime, unique=True, nullable=False)  # exclusive
+    period_income = db.Column(db.Float, default=0, nullable=False)
+    period_expenses = db.Column(db.Float, default=0, nullable=False)
+    total_income = db.Column(db.Float, default=0, nullable=False)  # cumulative up to period_end
+    total_expenses = db.Column(db.Float, default=0, nullable=False)
+    transaction_count = db.Column(db.Integer, default=0, nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'period': self.period_start.strftime('%Y-%m'),
+            'period_income': self.period_income,
+            'period_expenses': self.period_expenses,
+            'total_income': self.total_income,
+            'total_expenses': self.total_expenses,
+            'balance': self.total_income - self.total_expenses,
+            'transaction_count': self.transaction_count,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S')
+        }
+
+    def __repr__(self):
+        return f'<BalanceSnapshot {self.period_start:%Y-%m}>'
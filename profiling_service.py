@@ -0,0 +1,237 @@
+import os
+import sys
+import math
+import time
+import heapq
+import itertools
+import threading
+from collections import Counter
+from datetime import datetime
+
+from flask import g, request
+
+class SamplingProfiler:
+    """Background thread that samples the Python stacks of tracked request threads"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self._tracked = {}  # thread id -> Counter of collapsed stacks
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def track(self, thread_id):
+        """Start collecting samples for a thread"""
+        with self._lock:
+            self._tracked[thread_id] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='sampling-profiler', daemon=True)
+                self._thread.start()
+
+    def untrack(self, thread_id):
+        """Stop collecting samples for a thread and return what was collected"""
+        with self._lock:
+            return self._tracked.pop(thread_id, Counter())
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            if not self._tracked:
+                continue
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, stacks in self._tracked.items():
+                    frame = frames.get(thread_id)
+                    if frame is not None:
+                        stacks[self.collapse(frame)] += 1
+
+    @staticmethod
+    def collapse(frame):
+        """Render a frame chain root-first in collapsed-stack format"""
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+class RequestProfiler:
+    """On-demand and always-on request profiling for a single worker process"""
+
+    # Never profile the profiling endpoints themselves or static assets
+    EXCLUDED_PREFIXES = ('/api/admin/profiling', '/static/')
+
+    # Longest on-demand capture that can be requested
+    MAX_CAPTURE_SECONDS = 3600
+    MAX_CAPTURE_REQUESTS = 10000
+
+    def __init__(self):
+        self.always_on = os.getenv('PROFILING_ALWAYS_ON', 'false').lower() == 'true'
+        self.top_k = int(os.getenv('PROFILING_TOP_K', '10'))
+        self.sampler = SamplingProfiler(interval=int(os.getenv('PROFILING_INTERVAL_MS', '10')) / 1000)
+
+        self._lock = threading.Lock()
+        self._counter = itertools.count()
+        self.reset()
+
+    def init_app(self, app):
+        """Register request hooks on the Flask app"""
+        app.before_request(self._before_request)
+        app.after_request(self._after_request)
+        app.teardown_request(self._teardown_request)
+
+    def reset(self):
+        """Stop any capture and discard collected profiles"""
+        with self._lock:
+            self._capture_until = None
+            self._capture_remaining = None
+            self._capture_route = None
+            self.stacks = Counter()
+            self.requests_profiled = 0
+            self._slowest = []  # min-heap of (duration, sequence, record)
+
+    def start_capture(self, seconds=None, requests=None, route=None):
+        """Profile requests for the next N seconds and/or the next N requests matching route"""
+        if seconds is not None and not (math.isfinite(seconds) and 0 < seconds <= self.MAX_CAPTURE_SECONDS):
+            raise ValueError(f'seconds must be between 0 and {self.MAX_CAPTURE_SECONDS}')
+        if requests is not None and not 0 < requests <= self.MAX_CAPTURE_REQUESTS:
+            raise ValueError(f'requests must be between 1 and {self.MAX_CAPTURE_REQUESTS}')
+        with self._lock:
+            self._capture_until = time.monotonic() + seconds if seconds is not None else None
+            self._capture_remaining = requests
+            self._capture_route = route
+
+    def stop_capture(self):
+        """Stop an on-demand capture, keeping what was collected"""
+        with self._lock:
+            self._capture_until = None
+            self._capture_remaining = None
+            self._capture_route = None
+
+    def _capture_active(self):
+        if self._capture_until is None and self._capture_remaining is None:
+            return False
+        if self._capture_until is not None and time.monotonic() >= self._capture_until:
+            return False
+        if self._capture_remaining is not None and self._capture_remaining <= 0:
+            return False
+        return True
+
+    def _claim_capture(self):
+        """Decide whether the current request is captured, consuming one from the request budget"""
+        with self._lock:
+            if not self._capture_active():
+                return False
+            if self._capture_route:
+                rule = request.url_rule.rule if request.url_rule else None
+                if self._capture_route not in (request.path, rule):
+                    return False
+            if self._capture_remaining is not None:
+                self._capture_remaining -= 1
+            return True
+
+    def _before_request(self):
+        if request.path.startswith(self.EXCLUDED_PREFIXES):
+            return
+        capture = self._claim_capture()
+        if not capture and not self.always_on:
+            return
+        g.profiling = {
+            'capture': capture,
+            'started': time.perf_counter(),
+            'started_at': datetime.utcnow(),
+        }
+        self.sampler.track(threading.get_ident())
+
+    def _after_request(self, response):
+        if 'profiling' in g:
+            g.profiling['status'] = response.status_code
+        return response
+
+    def _teardown_request(self, exc):
+        profiling = g.pop('profiling', None)
+        if profiling is None:
+            return
+        stacks = self.sampler.untrack(threading.get_ident())
+        duration = time.perf_counter() - profiling['started']
+
+        with self._lock:
+            if profiling['capture']:
+                self.stacks.update(stacks)
+                self.requests_profiled += 1
+            if self.always_on and self.top_k > 0:
+                record = {
+                    'method': request.method,
+                    'path': request.path,
+                    'status': profiling.get('status', 500),
+                    'duration_ms': round(duration * 1000, 2),
+                    'started_at': profiling['started_at'].strftime('%Y-%m-%d %H:%M:%S'),
+                    'stacks': stacks,
+                }
+                entry = (duration, next(self._counter), record)
+                if len(self._slowest) < self.top_k:
+                    heapq.heappush(self._slowest, entry)
+                elif duration > self._slowest[0][0]:
+                    heapq.heapreplace(self._slowest, entry)
+
+    @staticmethod
+    def format_collapsed(stacks):
+        """Render stack counts in the collapsed format read by flamegraph.pl and speedscope"""
+        return '\n'.join(f"{stack} {count}" for stack, count in stacks.most_common())
+
+    def collapsed(self):
+        with self._lock:
+            return self.format_collapsed(self.stacks)
+
+    def function_stats(self, limit=50):
+        """Aggregate self and cumulative time per function across all captured requests"""
+        with self._lock:
+            stacks = Counter(self.stacks)
+
+        cumulative = Counter()
+        own = Counter()
+        for stack, count in stacks.items():
+            frames = stack.split(';')
+            own[frames[-1]] += count
+            # Recursive functions count once per sample
+            for name in set(frames):
+                cumulative[name] += count
+
+        interval_ms = self.sampler.interval * 1000
+        return [
+            {
+                'function': name,
+                'samples': count,
+                'cumulative_ms': round(count * interval_ms, 2),
+                'self_ms': round(own[name] * interval_ms, 2),
+            }
+            for name, count in cumulative.most_common(limit)
+        ]
+
+    def slowest(self):
+        """Return the slowest requests seen in always-on mode, slowest first"""
+        with self._lock:
+            entries = sorted(self._slowest, reverse=True)
+        return [
+            dict(record, stacks=self.format_collapsed(record['stacks']))
+            for _, _, record in entries
+        ]
+
+    def status(self):
+        with self._lock:
+            remaining_seconds = None
+            if self._capture_active() and self._capture_until is not None:
+                remaining_seconds = round(self._capture_until - time.monotonic(), 1)
+            return {
+                'capturing': self._capture_active(),
+                'remaining_seconds': remaining_seconds,
+                'remaining_requests': self._capture_remaining,
+                'route': self._capture_route,
+                'requests_profiled': self.requests_profiled,
+                'always_on': self.always_on,
+                'top_k': self.top_k,
+                'interval_ms': self.sampler.interval * 1000,
+                'pid': os.getpid(),
+            }
+
+# Global profiler instance
+request_profiler = RequestProfiler()
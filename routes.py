@@ -1,13 +1,17 @@
 
 from flask import render_template, request, jsonify, url_for, session
 from app import app, db
-from models import Transaction, MpesaPayment, User
+from models import Transaction, MpesaPayment, User, TransactionArchive, MpesaPaymentArchive, BalanceSnapshot
 from mpesa_service import mpesa_api
+from search_service import transaction_search
+from profiling_service import request_profiler
+from archive_service import history_archive, add_months
 import logging
 from flask_mail import Mail, Message
 from email_validator import validate_email, EmailNotValidError
 from itsdangerous import URLSafeTimedSerializer, SignatureExpired, BadSignature
 import os
+from datetime import datetime
 
 # Mail setup
 app.config['MAIL_SERVER'] = 'smtp.gmail.com'  # Change to your mail server
@@ -18,6 +22,28 @@ app.config['MAIL_PASSWORD'] = os.environ.get('MAIL_PASSWORD')
 mail = Mail(app)
 serializer = URLSafeTimedSerializer(app.secret_key)
 
+# Search index setup command (flask init-search)
+transaction_search.init_app(app)
+
+# Profiling hooks (no overhead until a capture is started or always-on mode is enabled)
+request_profiler.init_app(app)
+
+# History compaction command (flask compact-history)
+history_archive.init_app(app)
+
+def current_user_is_admin():
+    """Admins are logged-in users who have verified an email listed in ADMIN_EMAILS"""
+    user_id = session.get('user_id')
+    if not user_id:
+        return False
+    user = db.session.get(User, user_id)
+    # Anyone can register with a listed address; only the verification link
+    # proves the account belongs to its owner
+    if not user or not user.is_verified:
+        return False
+    admin_emails = {e.strip().lower() for e in os.environ.get('ADMIN_EMAILS', '').split(',') if e.strip()}
+    return user.email.lower() in admin_emails
+
 # --- User Authentication Routes ---
 @app.route('/api/signup', methods=['POST'])
 def signup():
@@ -79,7 +105,7 @@ def index():
 
 @app.route('/api/transactions', methods=['GET'])
 def get_transactions():
-    """Get all transactions ordered by date (newest first)"""
+    """Get live (unarchived) transactions ordered by date (newest first)"""
     try:
         transactions = Transaction.query.order_by(Transaction.created_at.desc()).all()
         return jsonify({
@@ -93,6 +119,71 @@ def get_transactions():
             'error': 'Failed to fetch transactions'
         }), 500
 
+@app.route('/api/transactions/search', methods=['GET'])
+def search_transactions():
+    """Search transactions by description, optionally filtered by type and date range.
+
+    Archived transactions are only searched with include_archived=true.
+    """
+    query = request.args.get('q', '').strip()
+    transaction_type = request.args.get('type')
+    include_archived = request.args.get('include_archived', 'false').lower()
+    
+    if not query:
+        return jsonify({
+            'success': False,
+            'error': 'Missing search query: q'
+        }), 400
+    
+    if transaction_type and transaction_type not in ['income', 'expense']:
+        return jsonify({
+            'success': False,
+            'error': 'Transaction type must be either "income" or "expense"'
+        }), 400
+    
+    if include_archived not in ['true', 'false']:
+        return jsonify({
+            'success': False,
+            'error': 'include_archived must be either "true" or "false"'
+        }), 400
+    
+    try:
+        start_date = transaction_search.parse_date(request.args.get('start_date'))
+        end_date = transaction_search.parse_date(request.args.get('end_date'))
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'Dates must be in YYYY-MM-DD format'
+        }), 400
+    
+    try:
+        limit = min(max(int(request.args.get('limit', 50)), 1), 200)
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'Invalid limit'
+        }), 400
+    
+    try:
+        transactions = transaction_search.search(
+            query,
+            transaction_type=transaction_type,
+            start_date=start_date,
+            end_date=end_date,
+            limit=limit,
+            include_archived=include_archived == 'true'
+        )
+        return jsonify({
+            'success': True,
+            'transactions': [t.to_dict() for t in transactions]
+        })
+    except Exception as e:
+        logging.error(f"Error searching transactions: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'Failed to search transactions'
+        }), 500
+
 @app.route('/api/transactions', methods=['POST'])
 def add_transaction():
     """Add a new transaction"""
@@ -154,15 +245,9 @@ def add_transaction():
 def get_balance():
     """Calculate and return current balance"""
     try:
-        # Calculate total income
-        total_income = db.session.query(db.func.sum(Transaction.amount)).filter(
-            Transaction.transaction_type == 'income'
-        ).scalar() or 0
-        
-        # Calculate total expenses
-        total_expenses = db.session.query(db.func.sum(Transaction.amount)).filter(
-            Transaction.transaction_type == 'expense'
-        ).scalar() or 0
+        # Totals of closed periods are carried forward from the latest snapshot,
+        # so only the live (unarchived) transactions are summed
+        total_income, total_expenses = history_archive.balance_totals()
         
         # Calculate balance
         balance = total_income - total_expenses
@@ -181,6 +266,49 @@ def get_balance():
             'error': 'Failed to calculate balance'
         }), 500
 
+@app.route('/api/transactions/archive', methods=['GET'])
+def get_archived_transactions():
+    """Get archived transactions for one closed month (newest first)"""
+    try:
+        period_start = datetime.strptime(request.args.get('month', ''), '%Y-%m')
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'Month must be in YYYY-MM format'
+        }), 400
+    
+    try:
+        transactions = TransactionArchive.query.filter(
+            TransactionArchive.created_at >= period_start,
+            TransactionArchive.created_at < add_months(period_start, 1)
+        ).order_by(TransactionArchive.created_at.desc()).all()
+        return jsonify({
+            'success': True,
+            'transactions': [t.to_dict() for t in transactions]
+        })
+    except Exception as e:
+        logging.error(f"Error fetching archived transactions: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'Failed to fetch archived transactions'
+        }), 500
+
+@app.route('/api/balance/snapshots', methods=['GET'])
+def get_balance_snapshots():
+    """Get balance snapshots of closed periods (newest first)"""
+    try:
+        snapshots = BalanceSnapshot.query.order_by(BalanceSnapshot.period_end.desc()).all()
+        return jsonify({
+            'success': True,
+            'snapshots': [s.to_dict() for s in snapshots]
+        })
+    except Exception as e:
+        logging.error(f"Error fetching balance snapshots: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'Failed to fetch balance snapshots'
+        }), 500
+
 @app.route('/api/transactions/<int:transaction_id>', methods=['DELETE'])
 def delete_transaction(transaction_id):
     """Delete a specific transaction"""
@@ -360,7 +488,7 @@ def mpesa_callback():
 
 @app.route('/api/mpesa/payments', methods=['GET'])
 def get_mpesa_payments():
-    """Get M-Pesa payment history"""
+    """Get live (unarchived) M-Pesa payment history"""
     try:
         payments = MpesaPayment.query.order_by(MpesaPayment.created_at.desc()).all()
         return jsonify({
@@ -374,6 +502,33 @@ def get_mpesa_payments():
             'error': 'Failed to fetch payment history'
         }), 500
 
+@app.route('/api/mpesa/payments/archive', methods=['GET'])
+def get_archived_mpesa_payments():
+    """Get archived M-Pesa payments for one closed month (newest first)"""
+    try:
+        period_start = datetime.strptime(request.args.get('month', ''), '%Y-%m')
+    except ValueError:
+        return jsonify({
+            'success': False,
+            'error': 'Month must be in YYYY-MM format'
+        }), 400
+    
+    try:
+        payments = MpesaPaymentArchive.query.filter(
+            MpesaPaymentArchive.created_at >= period_start,
+            MpesaPaymentArchive.created_at < add_months(period_start, 1)
+        ).order_by(MpesaPaymentArchive.created_at.desc()).all()
+        return jsonify({
+            'success': True,
+            'payments': [p.to_dict() for p in payments]
+        })
+    except Exception as e:
+        logging.error(f"Error fetching archived M-Pesa payments: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'Failed to fetch archived payment history'
+        }), 500
+
 @app.route('/api/mpesa/query/<int:payment_id>', methods=['GET'])
 def query_mpesa_payment(payment_id):
     """Query M-Pesa payment status"""
@@ -395,3 +550,123 @@ def query_mpesa_payment(payment_id):
             'success': False,
             'error': 'Failed to query payment status'
         }), 500
+
+# Profiling Routes (admin only, state is per worker process)
+
+@app.route('/api/admin/profiling', methods=['GET'])
+def profiling_status():
+    """Get the profiler state for this worker"""
+    if not current_user_is_admin():
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+    return jsonify({
+        'success': True,
+        'status': request_profiler.status()
+    })
+
+@app.route('/api/admin/profiling/start', methods=['POST'])
+def start_profiling():
+    """Profile the next N seconds and/or the next N requests, optionally for one route"""
+    if not current_user_is_admin():
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+    
+    data = request.get_json(silent=True)
+    if data is None:
+        data = {}
+    if not isinstance(data, dict):
+        return jsonify({
+            'success': False,
+            'error': 'Request body must be a JSON object'
+        }), 400
+    
+    # float() and int() would take JSON true as 1
+    if isinstance(data.get('seconds'), bool) or isinstance(data.get('requests'), bool):
+        return jsonify({
+            'success': False,
+            'error': 'seconds and requests must be numbers'
+        }), 400
+    
+    try:
+        seconds = float(data['seconds']) if data.get('seconds') is not None else None
+        requests_count = int(data['requests']) if data.get('requests') is not None else None
+    except (ValueError, TypeError, OverflowError):
+        return jsonify({
+            'success': False,
+            'error': 'seconds and requests must be numbers'
+        }), 400
+    
+    if seconds is None and requests_count is None:
+        return jsonify({
+            'success': False,
+            'error': 'Provide seconds, requests, or both'
+        }), 400
+    
+    route = data.get('route')
+    if route is not None and not isinstance(route, str):
+        return jsonify({
+            'success': False,
+            'error': 'route must be a string'
+        }), 400
+    
+    try:
+        request_profiler.start_capture(seconds=seconds, requests=requests_count, route=route)
+    except ValueError as e:
+        return jsonify({
+            'success': False,
+            'error': str(e)
+        }), 400
+    return jsonify({
+        'success': True,
+        'status': request_profiler.status()
+    })
+
+@app.route('/api/admin/profiling/stop', methods=['POST'])
+def stop_profiling():
+    """Stop the current capture, keeping collected samples"""
+    if not current_user_is_admin():
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+    request_profiler.stop_capture()
+    return jsonify({
+        'success': True,
+        'status': request_profiler.status()
+    })
+
+@app.route('/api/admin/profiling/reset', methods=['POST'])
+def reset_profiling():
+    """Discard collected samples and slow-request records"""
+    if not current_user_is_admin():
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+    request_profiler.reset()
+    return jsonify({
+        'success': True,
+        'status': request_profiler.status()
+    })
+
+@app.route('/api/admin/profiling/flamegraph', methods=['GET'])
+def profiling_flamegraph():
+    """Export captured samples as collapsed stacks for flamegraph.pl or speedscope"""
+    if not current_user_is_admin():
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+    return request_profiler.collapsed(), 200, {'Content-Type': 'text/plain; charset=utf-8'}
+
+@app.route('/api/admin/profiling/functions', methods=['GET'])
+def profiling_functions():
+    """Get per-function cumulative and self time across captured requests"""
+    if not current_user_is_admin():
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify({
+        'success': True,
+        'requests_profiled': request_profiler.status()['requests_profiled'],
+        'functions': request_profiler.function_stats(limit=limit)
+    })
+
+@app.route('/api/admin/profiling/slowest', methods=['GET'])
+def profiling_slowest():
+    """Get the slowest requests recorded in always-on mode with their profiles"""
+    if not current_user_is_admin():
+        return jsonify({'success': False, 'error': 'Admin access required'}), 403
+    return jsonify({
+        'success': True,
+        'always_on': request_profiler.always_on,
+        'requests': request_profiler.slowest()
+    })
@@ -0,0 +1,368 @@
+import os
+import re
+import logging
+from datetime import datetime, timedelta
+
+from sqlalchemy import select, func, false, text, bindparam, table, column, literal, union_all
+from sqlalchemy.dialects.postgresql import TSQUERY
+
+from app import db
+from models import Transaction, TransactionArchive
+
+class TransactionSearch:
+    """Full-text search over transaction descriptions"""
+
+    # Terms are letters and digits only, split the way both tokenizers split words;
+    # FTS5 and tsquery syntax characters are never passed through
+    TERM_PATTERN = re.compile(r'[^\W_]+', re.UNICODE)
+
+    TRANSACTION_TYPES = ('income', 'expense')
+
+    # Live and compacted transactions are indexed the same way
+    MODELS = (Transaction, TransactionArchive)
+
+    # Longest prefix served from the FTS5 prefix indexes. A longer prefix would
+    # merge the doclists of every word it covers, so those words are looked up
+    # in the vocabulary and matched exactly instead.
+    MAX_INDEXED_PREFIX = 8
+
+    # Prefixes covering more indexed words than this are left to FTS5
+    MAX_PREFIX_WORDS = 32
+
+    def __init__(self):
+        # Ranking runs over at most this many of the newest matches, so a common
+        # term costs the same as a rare one instead of scoring every row
+        self.candidate_limit = int(os.getenv('SEARCH_CANDIDATE_LIMIT', '500'))
+        self._indexed = set()
+        self._reported_missing = set()
+
+    def init_app(self, app):
+        """Register the index setup command on the Flask CLI"""
+        @app.cli.command('init-search')
+        def init_search():
+            """Create the transaction search indexes and backfill them."""
+            self.setup()
+
+    def setup(self):
+        """Create the text indexes and keep them in sync with the transaction and archive tables"""
+        dialect = db.engine.dialect.name
+        if dialect == 'sqlite':
+            with db.engine.begin() as conn:
+                for model in self.MODELS:
+                    self._setup_sqlite(conn, model.__tablename__)
+        elif dialect == 'postgresql':
+            for model in self.MODELS:
+                self._setup_postgresql(model.__tablename__)
+        else:
+            logging.warning(f"Full-text search is not supported on {dialect}; falling back to LIKE")
+
+    def _setup_sqlite(self, conn, table_name):
+        index = f'{table_name}_search_index'
+        source = f'{table_name}_search_source'
+        exists = conn.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"
+        ), {'name': index}).first()
+
+        # Type and month are indexed next to the description so filters narrow the
+        # match inside FTS5 instead of row by row after it
+        conn.execute(text(
+            f"CREATE VIEW IF NOT EXISTS {source} AS "
+            "SELECT id, description, transaction_type, strftime('m%Y%m', created_at) AS period "
+            f'FROM "{table_name}"'
+        ))
+        # External content: the index stores no copy of the rows
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {index} USING fts5("
+            "description, transaction_type, period, "
+            f"content='{source}', content_rowid='id', prefix='2 3 4 5 6 7 8')"
+        ))
+        # Lists the indexed words, for prefixes longer than the prefix indexes
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {table_name}_search_vocab USING fts5vocab({index}, instance)"
+        ))
+        insert = (
+            f"INSERT INTO {index}(rowid, description, transaction_type, period) "
+            "VALUES (new.id, new.description, new.transaction_type, strftime('m%Y%m', new.created_at)); "
+        )
+        delete = (
+            f"INSERT INTO {index}({index}, rowid, description, transaction_type, period) "
+            "VALUES ('delete', old.id, old.description, old.transaction_type, strftime('m%Y%m', old.created_at)); "
+        )
+        conn.execute(text(
+            f'CREATE TRIGGER IF NOT EXISTS {table_name}_search_insert AFTER INSERT ON "{table_name}" '
+            f"BEGIN {insert}END"
+        ))
+        conn.execute(text(
+            f'CREATE TRIGGER IF NOT EXISTS {table_name}_search_delete AFTER DELETE ON "{table_name}" '
+            f"BEGIN {delete}END"
+        ))
+        conn.execute(text(
+            f'CREATE TRIGGER IF NOT EXISTS {table_name}_search_update '
+            f'AFTER UPDATE OF description, transaction_type, created_at ON "{table_name}" '
+            f"BEGIN {delete}{insert}END"
+        ))
+        if not exists:
+            # Index rows that existed before search was enabled
+            conn.execute(text(f"INSERT INTO {index}({index}) VALUES ('rebuild')"))
+
+    def _setup_postgresql(self, table_name):
+        index = f'{table_name}_search_index'
+        partitions = [(f'{index}_{name}', f"FOR VALUES IN ('{name}')") for name in self.TRANSACTION_TYPES]
+        partitions.append((f'{index}_other', 'DEFAULT'))
+
+        # A narrow side table holds the stored tsvector, so matching never recomputes
+        # to_tsvector over the wide rows. It is partitioned by type so each type gets
+        # its own statistics, and a term common in one type but absent from the
+        # other is planned correctly for both.
+        with db.engine.begin() as conn:
+            conn.execute(text(
+                "CREATE OR REPLACE FUNCTION transaction_search_sync() RETURNS trigger LANGUAGE plpgsql AS $$ "
+                "BEGIN "
+                "IF TG_OP = 'UPDATE' THEN "
+                "EXECUTE format('DELETE FROM %I WHERE id = $1', TG_ARGV[0]) USING OLD.id; "
+                "END IF; "
+                "EXECUTE format('INSERT INTO %I (id, transaction_type, created_at, document) "
+                "VALUES ($1, $2, $3, to_tsvector(''simple'', $4))', TG_ARGV[0]) "
+                "USING NEW.id, NEW.transaction_type, NEW.created_at, NEW.description; "
+                "RETURN NULL; "
+                "END $$"
+            ))
+            conn.execute(text(
+                f"CREATE TABLE IF NOT EXISTS {index} ("
+                f'id integer NOT NULL REFERENCES "{table_name}" (id) ON DELETE CASCADE, '
+                "transaction_type varchar(10) NOT NULL, "
+                "created_at timestamp NOT NULL, "
+                "document tsvector NOT NULL, "
+                "PRIMARY KEY (id, transaction_type)"
+                ") PARTITION BY LIST (transaction_type)"
+            ))
+            for partition, bounds in partitions:
+                conn.execute(text(f"CREATE TABLE IF NOT EXISTS {partition} PARTITION OF {index} {bounds}"))
+            conn.execute(text(f'DROP TRIGGER IF EXISTS {table_name}_search_sync ON "{table_name}"'))
+            conn.execute(text(
+                f'CREATE TRIGGER {table_name}_search_sync '
+                f'AFTER INSERT OR UPDATE OF description, transaction_type, created_at ON "{table_name}" '
+                f"FOR EACH ROW EXECUTE FUNCTION transaction_search_sync('{index}')"
+            ))
+
+        # Backfill after the trigger exists so rows written meanwhile are not missed
+        with db.engine.begin() as conn:
+            conn.execute(text(
+                f"INSERT INTO {index} (id, transaction_type, created_at, document) "
+                "SELECT id, transaction_type, created_at, to_tsvector('simple', description) "
+                f'FROM "{table_name}" ON CONFLICT (id, transaction_type) DO NOTHING'
+            ))
+
+        # CREATE INDEX CONCURRENTLY cannot run inside a transaction block, and
+        # partitioned tables only take it partition by partition
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as conn:
+            for partition, _ in partitions:
+                conn.execute(text(
+                    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_{partition}_document "
+                    f"ON {partition} USING gin (document)"
+                ))
+                conn.execute(text(
+                    f"CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_{partition}_created_at "
+                    f"ON {partition} (created_at)"
+                ))
+            conn.execute(text(f"ANALYZE {index}"))
+
+    def parse_terms(self, query):
+        """Split a user query into lowercase search terms"""
+        return [term.lower() for term in self.TERM_PATTERN.findall(query or '')]
+
+    def parse_date(self, value):
+        """Parse a YYYY-MM-DD query parameter, returning None when absent"""
+        if not value:
+            return None
+        return datetime.strptime(value, '%Y-%m-%d')
+
+    def search(self, query, transaction_type=None, start_date=None, end_date=None, limit=50,
+               include_archived=False):
+        """Return transactions containing every term, the last one as a prefix, best matches first.
+
+        Archived transactions are searched too when include_archived is set.
+        """
+        terms = self.parse_terms(query)
+        if not terms:
+            return []
+        if end_date:
+            # End date is inclusive of the whole day
+            end_date = end_date + timedelta(days=1)
+
+        models = self.MODELS if include_archived else (Transaction,)
+        matches = []
+        for model in models:
+            candidates = self._candidates(model, terms, transaction_type, start_date, end_date)
+            matches.extend(
+                (model, row.id, row.description, row.created_at)
+                for row in db.session.query(model.id, model.description, model.created_at).join(
+                    candidates, candidates.c.id == model.id
+                )
+            )
+
+        # Ranking runs here, over the bounded candidates, rather than with bm25()
+        # or ts_rank(), whose term statistics scan every match. Descriptions are
+        # split the same way as the query, so only whole words (and whole-word
+        # prefixes for the last term) count: "rent" ranks "Rent June" above
+        # "Current account rent".
+        matches.sort(key=lambda match: match[3], reverse=True)
+        matches.sort(key=lambda match: self._rank(match[2], terms))
+        best = matches[:limit]
+
+        # Only the rows being returned are loaded in full
+        loaded = {}
+        for model in models:
+            ids = [match[1] for match in best if match[0] is model]
+            if ids:
+                loaded.update(((model, row.id), row) for row in model.query.filter(model.id.in_(ids)))
+        return [loaded[(model, id_)] for model, id_, _, _ in best]
+
+    def _rank(self, description, terms):
+        """Sort key: most term occurrences first, then the shortest description"""
+        *words, last = terms
+        tokens = self.parse_terms(description)
+        occurrences = sum(tokens.count(word) for word in words)
+        occurrences += sum(token.startswith(last) for token in tokens)
+        return -occurrences, len(tokens)
+
+    def _candidates(self, model, terms, transaction_type, start_date, end_date):
+        if self.is_indexed(model):
+            if db.engine.dialect.name == 'sqlite':
+                return self._sqlite_candidates(model, terms, transaction_type, start_date, end_date)
+            return self._postgresql_candidates(model, terms, transaction_type, start_date, end_date)
+        return select(model.id).where(
+            *[model.description.icontains(term, autoescape=True) for term in terms],
+            *self._filters(model, transaction_type, start_date, end_date)
+        ).order_by(model.created_at.desc()).limit(self.candidate_limit).subquery()
+
+    def is_indexed(self, model):
+        """Whether init-search has built the text index for a model's table"""
+        if model in self._indexed:
+            return True
+        table_name = model.__tablename__
+        dialect = db.engine.dialect.name
+        if dialect == 'sqlite':
+            names = [f'{table_name}_search_index', f'{table_name}_search_vocab']
+            found = db.session.execute(text(
+                "SELECT count(*) FROM sqlite_master WHERE type = 'table' AND name IN :names"
+            ).bindparams(bindparam('names', expanding=True)), {'names': names}).scalar() == len(names)
+        elif dialect == 'postgresql':
+            found = db.session.execute(
+                text("SELECT to_regclass(:name) IS NOT NULL"), {'name': f'{table_name}_search_index'}
+            ).scalar()
+        else:
+            return False
+
+        if found:
+            self._indexed.add(model)
+        elif model not in self._reported_missing:
+            self._reported_missing.add(model)
+            logging.warning(f"No search index for {table_name}; searching it with LIKE until 'flask init-search' runs")
+        return found
+
+    def _filters(self, source, transaction_type, start_date, end_date):
+        filters = []
+        if transaction_type:
+            filters.append(source.transaction_type == transaction_type)
+        if start_date:
+            filters.append(source.created_at >= start_date)
+        if end_date:
+            filters.append(source.created_at < end_date)
+        return filters
+
+    def _sqlite_candidates(self, model, terms, transaction_type, start_date, end_date):
+        index_name = f'{model.__tablename__}_search_index'
+        *words, last = terms
+        if len(last) > self.MAX_INDEXED_PREFIX:
+            expanded = self._prefix_words(model, last)
+            if expanded == []:
+                return select(model.id).where(false()).subquery()
+            prefix = f'"{last}"*' if expanded is None else '(' + ' OR '.join(f'"{word}"' for word in expanded) + ')'
+        else:
+            prefix = f'"{last}"*'
+
+        match = 'description: (' + ' '.join([f'"{word}"' for word in words] + [prefix]) + ')'
+        if transaction_type:
+            match += f' AND transaction_type: "{transaction_type}"'
+        periods = self._periods(model, start_date, end_date)
+        if periods == []:
+            return select(model.id).where(false()).subquery()
+        if periods:
+            match += ' AND period: (' + ' OR '.join(f'"{period}"' for period in periods) + ')'
+
+        # FTS5 walks matches newest id first and stops at the candidate limit.
+        # Periods are whole months, so the row filter trims the ends of the range.
+        index = table(index_name, column('rowid'))
+        return select(index.c.rowid.label('id')).select_from(index).join(
+            model, model.id == index.c.rowid
+        ).where(
+            text(f'{index_name} MATCH :match').bindparams(match=match),
+            *self._filters(model, None, start_date, end_date)
+        ).order_by(index.c.rowid.desc()).limit(self.candidate_limit).subquery()
+
+    def _prefix_words(self, model, prefix):
+        """Indexed words starting with prefix, or None when there are too many to list"""
+        vocab = text(
+            f"SELECT term FROM {model.__tablename__}_search_vocab "
+            "WHERE term >= :lower AND term < :upper LIMIT 1"
+        )
+        # Each lookup seeks straight past the previous word instead of reading its instances
+        words = []
+        lower = prefix
+        while len(words) <= self.MAX_PREFIX_WORDS:
+            word = db.session.execute(vocab, {'lower': lower, 'upper': prefix + '\U0010ffff'}).scalar()
+            if word is None:
+                return words
+            words.append(word)
+            lower = word + '\x00'
+        return None
+
+    def _postgresql_candidates(self, model, terms, transaction_type, start_date, end_date):
+        *words, last = terms
+        # Terms are plain words, so they can be quoted into a tsquery literal directly
+        tsquery = literal(' & '.join([f"'{word}'" for word in words] + [f"'{last}':*"])).cast(TSQUERY)
+
+        index = table(
+            f'{model.__tablename__}_search_index',
+            column('id'), column('transaction_type'), column('created_at'), column('document')
+        )
+        # One branch per type so each is planned against its own partition, and
+        # each walks its created_at index newest first until it has enough matches
+        branches = [
+            select(index.c.id, index.c.created_at).where(
+                index.c.document.op('@@')(tsquery),
+                *self._filters(index.c, name, start_date, end_date)
+            ).order_by(index.c.created_at.desc()).limit(self.candidate_limit)
+            for name in ([transaction_type] if transaction_type else self.TRANSACTION_TYPES)
+        ]
+        merged = union_all(*branches).subquery()
+        return select(merged.c.id).order_by(merged.c.created_at.desc()).limit(self.candidate_limit).subquery()
+
+    def _periods(self, model, start_date, end_date):
+        """Month tokens covering the date range, [] when no rows can match, or None for no filter"""
+        if not start_date and not end_date:
+            return None
+        # Clamp to the months that have rows, so an open or wide range stays finite
+        oldest = db.session.query(func.min(model.created_at)).scalar()
+        newest = db.session.query(func.max(model.created_at)).scalar()
+        if oldest is None:
+            return []
+        first = max(start_date or oldest, oldest)
+        last = min(end_date - timedelta(microseconds=1) if end_date else newest, newest)
+        if last < first:
+            return []
+        if (first.year, first.month) == (oldest.year, oldest.month) and \
+                (last.year, last.month) == (newest.year, newest.month):
+            # Every month with rows is in range
+            return None
+        months = (last.year - first.year) * 12 + last.month - first.month + 1
+        periods = []
+        year, month = first.year, first.month
+        for _ in range(months):
+            periods.append(f'm{year:04d}{month:02d}')
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        return periods
+
+# Global search instance
+transaction_search = TransactionSearch()
@@ -0,0 +1,30 @@
+import os
+import tempfile
+
+import pytest
+
+# The app binds its database at import time, so point it at a scratch SQLite file
+# (or TEST_DATABASE_URL, for running the suite against PostgreSQL) first
+_db_dir = tempfile.mkdtemp(prefix='futurefund-tests-')
+os.environ['DATABASE_URL'] = os.environ.get('TEST_DATABASE_URL') or f"sqlite:///{os.path.join(_db_dir, 'test.db')}"
+
+from app import app as flask_app, db  # noqa: E402
+from models import Transaction  # noqa: E402
+
+@pytest.fixture(scope='session')
+def app():
+    flask_app.config['TESTING'] = True
+    return flask_app
+
+@pytest.fixture()
+def app_context(app):
+    with app.app_context():
+        yield
+        db.session.rollback()
+        Transaction.query.delete()
+        db.session.commit()
+        db.session.remove()
+
+@pytest.fixture()
+def client(app, app_context):
+    return app.test_client()
@@ -0,0 +1,112 @@
+from datetime import datetime
+
+import pytest
+
+from app import db
+from archive_service import history_archive, add_months, month_start
+from models import Transaction, TransactionArchive, MpesaPayment, MpesaPaymentArchive, BalanceSnapshot
+
+@pytest.fixture(autouse=True)
+def clean_archive(app_context):
+    yield
+    db.session.rollback()
+    for model in (MpesaPayment, MpesaPaymentArchive, TransactionArchive, BalanceSnapshot):
+        model.query.delete()
+    db.session.commit()
+
+@pytest.fixture()
+def runner(app):
+    return app.test_cli_runner()
+
+def this_month():
+    return month_start(datetime.utcnow())
+
+@pytest.mark.parametrize('before', ['2025-13', 'March', '2025-01-15'])
+def test_compact_history_rejects_malformed_month(runner, before):
+    result = runner.invoke(args=['compact-history', '--before', before])
+    assert result.exit_code == 2
+    assert "Invalid value for '--before'" in result.output
+
+def test_compact_history_rejects_future_month(runner):
+    next_month = add_months(this_month(), 1)
+    result = runner.invoke(args=['compact-history', '--before', f'{next_month:%Y-%m}'])
+    assert result.exit_code == 2
+    assert 'Cannot close the current or a future month' in result.output
+
+def test_compact_history_closes_months_before_cutoff(runner):
+    old = add_months(this_month(), -2)
+    db.session.add_all([
+        Transaction(description='Salary', amount=1000, transaction_type='income', created_at=old),
+        Transaction(description='Rent', amount=400, transaction_type='expense', created_at=old),
+        Transaction(description='Lunch', amount=50, transaction_type='expense', created_at=this_month()),
+    ])
+    db.session.commit()
+
+    result = runner.invoke(args=['compact-history', '--before', f'{this_month():%Y-%m}'])
+    assert result.exit_code == 0, result.output
+    assert [t.description for t in Transaction.query.all()] == ['Lunch']
+    assert sorted(t.description for t in TransactionArchive.query.all()) == ['Rent', 'Salary']
+    assert history_archive.latest_snapshot().total_income == 1000
+
+def test_balance_is_unchanged_by_compaction(client):
+    for months_ago, amount, transaction_type in [(3, 1000, 'income'), (2, 300, 'expense'),
+                                                 (1, 500, 'income'), (0, 120, 'expense')]:
+        db.session.add(Transaction(description='Entry', amount=amount, transaction_type=transaction_type,
+                                   created_at=add_months(this_month(), -months_ago)))
+    db.session.commit()
+    expected = {'success': True, 'balance': 1080, 'total_income': 1500, 'total_expenses': 420}
+    assert client.get('/api/balance').get_json() == expected
+
+    history_archive.compact(add_months(this_month(), -1))
+    assert BalanceSnapshot.query.count() == 2
+    assert client.get('/api/balance').get_json() == expected
+
+    history_archive.compact(this_month())
+    assert client.get('/api/balance').get_json() == expected
+
+def test_archived_payments_endpoint(client):
+    old = add_months(this_month(), -2)
+    transaction = Transaction(description='M-Pesa Payment: rent', amount=400,
+                              transaction_type='income', created_at=old)
+    db.session.add(transaction)
+    db.session.flush()
+    for checkout, status in [('ws_CO_1', 'success'), ('ws_CO_2', 'pending')]:
+        db.session.add(MpesaPayment(
+            checkout_request_id=checkout, phone_number='254700000000', amount=400,
+            account_reference='FutureFund', transaction_desc='rent', status=status,
+            transaction_id=transaction.id if status == 'success' else None, created_at=old
+        ))
+    db.session.commit()
+    history_archive.compact(this_month())
+
+    response = client.get(f'/api/mpesa/payments/archive?month={old:%Y-%m}')
+    assert response.status_code == 200
+    assert [p['checkout_request_id'] for p in response.get_json()['payments']] == ['ws_CO_1']
+    # Pending payments stay live so their callbacks can still settle them
+    assert [p['checkout_request_id'] for p in client.get('/api/mpesa/payments').get_json()['payments']] == ['ws_CO_2']
+    assert client.get('/api/mpesa/payments/archive?month=last').status_code == 400
+
+def test_archived_ids_are_not_reused_once_the_live_table_empties():
+    def add(description, created_at):
+        transaction = Transaction(description=description, amount=100,
+                                  transaction_type='income', created_at=created_at)
+        db.session.add(transaction)
+        db.session.flush()
+        db.session.add(MpesaPayment(
+            checkout_request_id=f'ws_{description}', phone_number='254700000000', amount=100,
+            account_reference='FutureFund', transaction_desc=description, status='success',
+            transaction_id=transaction.id, created_at=created_at
+        ))
+        db.session.commit()
+
+    add('first', add_months(this_month(), -2))
+    history_archive.compact(add_months(this_month(), -1))
+    assert Transaction.query.count() == 0 and MpesaPayment.query.count() == 0
+
+    add('second', add_months(this_month(), -1))
+    history_archive.compact(this_month())
+
+    archived = {t.id: t.description for t in TransactionArchive.query.all()}
+    assert sorted(archived.values()) == ['first', 'second']
+    for payment in MpesaPaymentArchive.query.all():
+        assert archived[payment.transaction_id] == payment.transaction_desc
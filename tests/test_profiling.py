@@ -0,0 +1,170 @@
+import re
+import time
+
+import pytest
+
+from app import db
+from archive_service import history_archive
+from models import User
+from profiling_service import request_profiler
+
+ADMIN_EMAIL = 'admin@example.com'
+
+@pytest.fixture(autouse=True)
+def admin_emails(monkeypatch):
+    monkeypatch.setenv('ADMIN_EMAILS', ADMIN_EMAIL)
+    yield
+    request_profiler.reset()
+
+@pytest.fixture()
+def slow_balance(monkeypatch):
+    """Make /api/balance spend its time in a function the samples can be checked for"""
+    def slow_balance_totals():
+        time.sleep(0.1)
+        return 0, 0
+    monkeypatch.setattr(history_archive, 'balance_totals', slow_balance_totals)
+
+@pytest.fixture()
+def login(client):
+    users = []
+
+    def login(email, is_verified):
+        # Admin checks never read the password
+        user = User(email=email, password_hash='unused', is_verified=is_verified)
+        db.session.add(user)
+        db.session.commit()
+        users.append(user)
+        with client.session_transaction() as session:
+            session['user_id'] = user.id
+
+    yield login
+    for user in users:
+        db.session.delete(user)
+    db.session.commit()
+
+def test_unverified_listed_email_is_not_admin(client, login):
+    login(ADMIN_EMAIL, is_verified=False)
+    assert client.get('/api/admin/profiling').status_code == 403
+
+def test_verified_unlisted_email_is_not_admin(client, login):
+    login('someone@example.com', is_verified=True)
+    assert client.get('/api/admin/profiling').status_code == 403
+
+def test_verified_listed_email_is_admin(client, login):
+    login(ADMIN_EMAIL, is_verified=True)
+    response = client.get('/api/admin/profiling')
+    assert response.status_code == 200
+    assert response.get_json()['success'] is True
+
+@pytest.mark.parametrize('body', [
+    {'seconds': 'nan'},
+    {'seconds': 'inf'},
+    {'seconds': '-inf'},
+    {'seconds': 0},
+    {'seconds': request_profiler.MAX_CAPTURE_SECONDS + 1},
+    {'requests': 'inf'},
+    {'requests': 0},
+    {'requests': request_profiler.MAX_CAPTURE_REQUESTS + 1},
+    {'seconds': 'soon'},
+    {'seconds': True},
+    {'requests': True},
+    {'seconds': 10, 'requests': False},
+    {'seconds': 10, 'route': ['/api/transactions']},
+    {},
+    [1],
+    'seconds',
+])
+def test_start_rejects_invalid_capture(client, login, body):
+    login(ADMIN_EMAIL, is_verified=True)
+    response = client.post('/api/admin/profiling/start', json=body)
+    assert response.status_code == 400
+    assert response.get_json()['success'] is False
+    assert not request_profiler.status()['capturing']
+
+def test_start_capture(client, login):
+    login(ADMIN_EMAIL, is_verified=True)
+    response = client.post('/api/admin/profiling/start', json={'seconds': 30, 'requests': 5})
+    assert response.status_code == 200
+    status = response.get_json()['status']
+    assert status['capturing'] is True
+    assert status['remaining_requests'] == 5
+    assert 0 < status['remaining_seconds'] <= 30
+
+def test_capture_stops_after_requests(client, login):
+    login(ADMIN_EMAIL, is_verified=True)
+    client.post('/api/admin/profiling/start', json={'requests': 2})
+    for _ in range(3):
+        client.get('/api/transactions')
+
+    status = client.get('/api/admin/profiling').get_json()['status']
+    assert status['requests_profiled'] == 2
+    assert status['remaining_requests'] == 0
+    assert status['capturing'] is False
+
+def test_capture_only_profiles_its_route(client, login):
+    login(ADMIN_EMAIL, is_verified=True)
+    client.post('/api/admin/profiling/start', json={'requests': 5, 'route': '/api/balance'})
+    client.get('/api/transactions')
+    client.get('/api/balance')
+
+    status = client.get('/api/admin/profiling').get_json()['status']
+    assert status['requests_profiled'] == 1
+    assert status['remaining_requests'] == 4
+
+def test_flamegraph_exports_collapsed_stacks(client, login, slow_balance):
+    login(ADMIN_EMAIL, is_verified=True)
+    client.post('/api/admin/profiling/start', json={'requests': 1})
+    client.get('/api/balance')
+
+    response = client.get('/api/admin/profiling/flamegraph')
+    assert response.mimetype == 'text/plain'
+    lines = response.get_data(as_text=True).splitlines()
+    assert lines
+    for line in lines:
+        assert re.fullmatch(r'\S.* \d+', line), line
+    # Root first, leaf last
+    stack = next(line.rsplit(' ', 1)[0] for line in lines if 'slow_balance_totals' in line)
+    frames = stack.split(';')
+    assert frames[-1].startswith('slow_balance_totals (test_profiling.py:')
+    assert any(frame.startswith('get_balance (routes.py:') for frame in frames)
+
+def test_function_stats_add_up_samples(client, login, slow_balance):
+    login(ADMIN_EMAIL, is_verified=True)
+    client.post('/api/admin/profiling/start', json={'requests': 1})
+    client.get('/api/balance')
+
+    samples = sum(int(line.rsplit(' ', 1)[1]) for line in
+                  client.get('/api/admin/profiling/flamegraph').get_data(as_text=True).splitlines())
+    body = client.get('/api/admin/profiling/functions?limit=1000').get_json()
+    assert body['requests_profiled'] == 1
+    functions = {entry['function'].split(' ')[0]: entry for entry in body['functions']}
+    interval_ms = request_profiler.sampler.interval * 1000
+
+    # Every sample has exactly one leaf, and the root is on every sample
+    assert sum(entry['self_ms'] for entry in body['functions']) == pytest.approx(samples * interval_ms)
+    assert max(entry['samples'] for entry in body['functions']) == samples
+    for entry in body['functions']:
+        assert entry['cumulative_ms'] == pytest.approx(entry['samples'] * interval_ms)
+        assert entry['self_ms'] <= entry['cumulative_ms']
+
+    sleeper, caller = functions['slow_balance_totals'], functions['get_balance']
+    assert sleeper['self_ms'] == sleeper['cumulative_ms'] > 0
+    assert caller['cumulative_ms'] >= sleeper['cumulative_ms']
+    assert caller['self_ms'] < caller['cumulative_ms']
+
+def test_always_on_keeps_slowest_requests(client, login, slow_balance, monkeypatch):
+    monkeypatch.setattr(request_profiler, 'always_on', True)
+    monkeypatch.setattr(request_profiler, 'top_k', 2)
+    login(ADMIN_EMAIL, is_verified=True)
+    client.get('/api/transactions')
+    client.get('/api/balance')
+    client.get('/api/transactions')
+    client.get('/api/transactions')
+
+    slowest = client.get('/api/admin/profiling/slowest').get_json()['requests']
+    assert [entry['path'] for entry in slowest] == ['/api/balance', '/api/transactions']
+    assert slowest[0]['duration_ms'] >= 100 > slowest[1]['duration_ms']
+    assert slowest[0]['status'] == 200
+    assert 'slow_balance_totals' in slowest[0]['stacks']
+    # Always-on records do not count as an on-demand capture
+    assert client.get('/api/admin/profiling').get_json()['status']['requests_profiled'] == 0
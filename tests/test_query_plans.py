@@ -0,0 +1,101 @@
+"""EXPLAIN the hot queries and fail if any of them regresses to a full scan.
+
+SQLite runs against the test database. PostgreSQL runs only when
+TEST_POSTGRES_URL is set, inside a throwaway schema.
+"""
+import os
+import uuid
+
+import pytest
+from sqlalchemy import create_engine, select, text
+
+from app import db
+from archive_service import history_archive
+from models import Transaction, MpesaPayment
+
+# Queries PostgreSQL must answer from the index alone
+INDEX_ONLY = {'balance', 'payment_reconciliation'}
+
+def hot_queries():
+    """Each indexed query with the index it must use.
+
+    Balance and both listings are what routes.py runs on every page load. The
+    receipt lookup and the pending-payment scan are the reads M-Pesa
+    reconciliation needs; no route issues them yet.
+    """
+    return {
+        'balance': (
+            history_archive.balance_query(),
+            'ix_transaction_type_amount',
+        ),
+        'transaction_listing': (
+            select(Transaction).order_by(Transaction.created_at.desc()),
+            'ix_transaction_created_at',
+        ),
+        'receipt_lookup': (
+            select(Transaction).where(Transaction.mpesa_receipt_number == 'QKJ3AB12CD'),
+            'ix_transaction_mpesa_receipt_number',
+        ),
+        'payment_reconciliation': (
+            select(MpesaPayment.status, MpesaPayment.created_at, MpesaPayment.checkout_request_id).where(
+                MpesaPayment.status == 'pending'
+            ).order_by(MpesaPayment.created_at),
+            'ix_mpesa_payment_status_created_at',
+        ),
+        'payment_history': (
+            select(MpesaPayment).order_by(MpesaPayment.created_at.desc()),
+            'ix_mpesa_payment_created_at',
+        ),
+    }
+
+def render(statement, engine):
+    return str(statement.compile(engine, compile_kwargs={'literal_binds': True}))
+
+@pytest.mark.parametrize('name', sorted(hot_queries()))
+def test_sqlite_plan_uses_index(app_context, name):
+    if db.engine.dialect.name != 'sqlite':
+        pytest.skip('suite is running against another database')
+    statement, index = hot_queries()[name]
+    with db.engine.connect() as conn:
+        plan = [row[-1] for row in conn.execute(text('EXPLAIN QUERY PLAN ' + render(statement, db.engine)))]
+
+    assert any(index in step for step in plan), plan
+    for step in plan:
+        # "SCAN t USING INDEX ix" walks an index in order; a bare "SCAN t" reads the whole
+        # table. "SCAN CONSTANT ROW" is a SELECT without FROM and reads nothing.
+        assert not (step.startswith('SCAN') and 'INDEX' not in step and step != 'SCAN CONSTANT ROW'), plan
+        assert 'TEMP B-TREE' not in step, plan
+
+@pytest.fixture(scope='module')
+def postgres_engine():
+    url = os.environ.get('TEST_POSTGRES_URL')
+    if not url:
+        pytest.skip('TEST_POSTGRES_URL is not set')
+
+    schema = f"explain_{uuid.uuid4().hex[:8]}"
+    admin = create_engine(url, isolation_level='AUTOCOMMIT')
+    with admin.connect() as conn:
+        conn.execute(text(f'CREATE SCHEMA {schema}'))
+    engine = create_engine(url, connect_args={'options': f'-csearch_path={schema}'})
+    db.metadata.create_all(engine)
+    try:
+        yield engine
+    finally:
+        engine.dispose()
+        with admin.connect() as conn:
+            conn.execute(text(f'DROP SCHEMA {schema} CASCADE'))
+        admin.dispose()
+
+@pytest.mark.parametrize('name', sorted(hot_queries()))
+def test_postgresql_plan_uses_index(postgres_engine, name):
+    statement, index = hot_queries()[name]
+    with postgres_engine.connect() as conn:
+        # Empty tables always favour a sequential scan; disabling it shows
+        # whether an index can serve the query at all
+        conn.execute(text('SET enable_seqscan = off'))
+        plan = '\n'.join(row[0] for row in conn.execute(text('EXPLAIN ' + render(statement, postgres_engine))))
+
+    assert index in plan, plan
+    assert 'Seq Scan' not in plan, plan
+    if name in INDEX_ONLY:
+        assert f'Index Only Scan using {index}' in plan, plan
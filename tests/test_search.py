@@ -0,0 +1,178 @@
+from datetime import datetime
+
+import pytest
+
+from app import db
+from archive_service import history_archive, add_months, month_start
+from models import Transaction, TransactionArchive, BalanceSnapshot
+from search_service import transaction_search
+
+@pytest.fixture(scope='module', autouse=True)
+def search_index(app):
+    with app.app_context():
+        transaction_search.setup()
+
+@pytest.fixture()
+def archived(app_context):
+    """Compact every month before the current one, then empty the archive afterwards"""
+    yield lambda: history_archive.compact(month_start(datetime.utcnow()))
+    db.session.rollback()
+    TransactionArchive.query.delete()
+    BalanceSnapshot.query.delete()
+    db.session.commit()
+
+def add(description, transaction_type='expense', created_at=None, amount=100):
+    transaction = Transaction(
+        description=description,
+        amount=amount,
+        transaction_type=transaction_type,
+        created_at=created_at or datetime.utcnow()
+    )
+    db.session.add(transaction)
+    db.session.commit()
+    return transaction
+
+def descriptions(results):
+    return [t.description for t in results]
+
+def test_last_term_matches_as_prefix(app_context):
+    add('Rent March')
+    add('Groceries at Naivas')
+
+    assert descriptions(transaction_search.search('ren')) == ['Rent March']
+    assert descriptions(transaction_search.search('groceries naiv')) == ['Groceries at Naivas']
+    assert transaction_search.search('ren march') == []
+
+def test_every_term_is_required(app_context):
+    add('M-Pesa Payment: groceries', transaction_type='income')
+    add('Groceries at Naivas')
+
+    assert descriptions(transaction_search.search('m-pesa groc')) == ['M-Pesa Payment: groceries']
+
+def test_prefix_longer_than_prefix_index(app_context):
+    add('Electricity bill')
+    add('Electrical repairs')
+    add('Reimbursement for taxi')
+    add('Reimbursements March')
+    add('Reimburse lunch')
+
+    assert descriptions(transaction_search.search('electricit')) == ['Electricity bill']
+    assert sorted(descriptions(transaction_search.search('reimburse'))) == [
+        'Reimburse lunch', 'Reimbursement for taxi', 'Reimbursements March'
+    ]
+    assert sorted(descriptions(transaction_search.search('reimbursem'))) == [
+        'Reimbursement for taxi', 'Reimbursements March'
+    ]
+    assert transaction_search.search('reimbursex') == []
+
+def test_ranks_repeated_terms_then_shorter_descriptions_first(app_context):
+    add('Rent deposit for the new flat')
+    add('Rent rent arrears')
+    add('Rent June')
+
+    assert descriptions(transaction_search.search('rent')) == [
+        'Rent rent arrears', 'Rent June', 'Rent deposit for the new flat'
+    ]
+
+def test_ranks_whole_words_not_substrings(app_context):
+    add('Rent June')
+    add('Current account rent')
+    add('Parent transfer rent')
+
+    assert descriptions(transaction_search.search('rent'))[0] == 'Rent June'
+    assert descriptions(transaction_search.search('june rent')) == ['Rent June']
+
+def test_type_and_date_filters(app_context):
+    add('Salary March', transaction_type='income', created_at=datetime(2025, 3, 28))
+    add('Salary advance repayment', created_at=datetime(2025, 3, 30))
+    add('Salary April', transaction_type='income', created_at=datetime(2025, 4, 28))
+
+    assert descriptions(transaction_search.search('salary', transaction_type='expense')) == ['Salary advance repayment']
+    assert descriptions(transaction_search.search(
+        'salary', transaction_type='income', start_date=datetime(2025, 3, 1), end_date=datetime(2025, 3, 28)
+    )) == ['Salary March']
+    assert descriptions(transaction_search.search('salary', start_date=datetime(2025, 4, 1))) == ['Salary April']
+    assert descriptions(transaction_search.search('salary', end_date=datetime(2025, 3, 29))) == ['Salary March']
+    assert transaction_search.search('salary', start_date=datetime(2026, 1, 1), end_date=datetime(2026, 2, 1)) == []
+
+def test_date_filters_spanning_many_months(app_context):
+    for year in (2022, 2023, 2024, 2025):
+        add(f'Insurance premium {year}', created_at=datetime(year, 6, 15))
+
+    assert descriptions(transaction_search.search(
+        'insurance', start_date=datetime(2023, 1, 1), end_date=datetime(2024, 12, 31)
+    )) == ['Insurance premium 2024', 'Insurance premium 2023']
+    assert descriptions(transaction_search.search('insurance', end_date=datetime(2023, 6, 15))) == [
+        'Insurance premium 2023', 'Insurance premium 2022'
+    ]
+
+def test_index_follows_updates_and_deletes(app_context):
+    transaction = add('Airtime Safaricom')
+    assert descriptions(transaction_search.search('airtime')) == ['Airtime Safaricom']
+
+    transaction.description = 'Data bundle Safaricom'
+    db.session.commit()
+    assert transaction_search.search('airtime') == []
+    assert descriptions(transaction_search.search('bundle')) == ['Data bundle Safaricom']
+
+    db.session.delete(transaction)
+    db.session.commit()
+    assert transaction_search.search('bundle') == []
+
+def test_query_syntax_is_not_passed_through(app_context):
+    add('School fees term 1')
+
+    assert descriptions(transaction_search.search('"school" OR NEAR(fees)*')) == []
+    assert descriptions(transaction_search.search('school: fees*')) == ['School fees term 1']
+
+def test_search_endpoint(client):
+    add('Fuel Total Kisumu')
+
+    response = client.get('/api/transactions/search?q=fuel')
+    assert response.status_code == 200
+    assert [t['description'] for t in response.get_json()['transactions']] == ['Fuel Total Kisumu']
+
+    assert client.get('/api/transactions/search').status_code == 400
+    assert client.get('/api/transactions/search?q=fuel&type=refund').status_code == 400
+    assert client.get('/api/transactions/search?q=fuel&start_date=01-01-2025').status_code == 400
+
+def test_archived_transactions_are_searched_on_request(archived):
+    last_year = add_months(month_start(datetime.utcnow()), -12)
+    add('Rent rent arrears', created_at=last_year)
+    add('Rent deposit for the new flat', created_at=last_year)
+    add('Rent June')
+    archived()
+
+    assert descriptions(transaction_search.search('rent')) == ['Rent June']
+    assert descriptions(transaction_search.search('rent', include_archived=True)) == [
+        'Rent rent arrears', 'Rent June', 'Rent deposit for the new flat'
+    ]
+    assert descriptions(transaction_search.search(
+        'rent', include_archived=True, end_date=last_year
+    )) == ['Rent rent arrears', 'Rent deposit for the new flat']
+
+def test_search_endpoint_includes_archived(client, archived):
+    add('Fuel Total Kisumu', created_at=add_months(month_start(datetime.utcnow()), -2))
+    archived()
+
+    response = client.get('/api/transactions/search?q=fuel')
+    assert response.get_json()['transactions'] == []
+    response = client.get('/api/transactions/search?q=fuel&include_archived=true')
+    assert [t['description'] for t in response.get_json()['transactions']] == ['Fuel Total Kisumu']
+    assert client.get('/api/transactions/search?q=fuel&include_archived=maybe').status_code == 400
+
+def test_search_without_index_falls_back_to_like(client, monkeypatch):
+    monkeypatch.setattr(transaction_search, 'is_indexed', lambda model: False)
+    add('Rent June')
+    add('Current account rent')
+    add('Electricity bill')
+
+    assert descriptions(transaction_search.search('rent'))[0] == 'Rent June'
+    assert descriptions(transaction_search.search('electricit')) == ['Electricity bill']
+    response = client.get('/api/transactions/search?q=rent')
+    assert response.status_code == 200
+    assert [t['description'] for t in response.get_json()['transactions']] == ['Rent June', 'Current account rent']
+
+def test_is_indexed_after_setup(app_context):
+    assert transaction_search.is_indexed(Transaction)
+    assert transaction_search.is_indexed(TransactionArchive)